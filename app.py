@@ -1,9 +1,22 @@
 
-import os, sqlite3
-from flask import Flask, render_template, request, redirect, url_for, g
+import os, sqlite3, datetime
+from flask import Flask, render_template, request, redirect, url_for, g, Response, abort
+from werkzeug.middleware.proxy_fix import ProxyFix
+from ratelimit import RateLimiter, DEFAULT_LIMITS
+import documents
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret")
+# Render place un proxy devant l'app : request.remote_addr doit être l'IP du client.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+app.config["RATELIMITS"] = {
+    **DEFAULT_LIMITS,
+    "dossier_contract": (10, 1 / 10),
+    "dossiers_contracts": (1, 1 / 60),
+}
+# Un seul export ZIP à la fois par worker, en dehors du plafond MAX_INFLIGHT.
+app.config["INFLIGHT_GROUPS"] = {"dossiers_contracts": (1, 30)}
+limiter = RateLimiter(app)
 
 DB_FILE = os.path.join(os.path.dirname(__file__), "crm.db")
 
@@ -77,5 +90,32 @@ def create_dossier():
         return redirect(url_for("dossiers"))
     return render_template("dossier_create.html")
 
+def fetch_dossiers(ids):
+    db = get_db()
+    cur = db.execute(
+        f"SELECT * FROM dossiers WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+    )
+    cols = [c[0] for c in cur.description]
+    return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+@app.route("/dossier/<int:dossier_id>/contrat")
+def dossier_contract(dossier_id):
+    rows = fetch_dossiers([dossier_id])
+    if not rows:
+        abort(404)
+    name, pdf = documents.render_one(rows[0])
+    return Response(pdf, mimetype="application/pdf",
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.route("/dossiers/contrats", methods=["POST"])
+def dossiers_contracts():
+    ids = request.form.getlist("ids", type=int)
+    if not ids:
+        return redirect(url_for("dossiers"))
+    rows = fetch_dossiers(ids)
+    stamp = datetime.date.today().isoformat()
+    return Response(documents.stream_zip(rows), mimetype="application/zip",
+                    headers={"Content-Disposition": f'attachment; filename="contrats-pee-{stamp}.zip"'})
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,154 @@
+import base64, collections, datetime, io, itertools, logging, multiprocessing, os, re, threading, unicodedata, zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(__file__)
+TEMPLATE = "contrat_pee.html"
+
+# État propre à chaque process du pool, chargé une seule fois par _init_worker().
+_env = _assets = _css = _fonts = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    global _env, _assets, _css, _fonts
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+    _env = Environment(
+        loader=FileSystemLoader(os.path.join(BASE_DIR, "templates")),
+        autoescape=select_autoescape(["html"]),
+    )
+    with open(os.path.join(BASE_DIR, "static", "logo.png"), "rb") as f:
+        logo = "data:image/png;base64," + base64.b64encode(f.read()).decode()
+    _assets = {"logo": logo}
+    _fonts = FontConfiguration()
+    _css = CSS(filename=os.path.join(BASE_DIR, "static", "contrat.css"), font_config=_fonts)
+
+
+def render_contract(dossier):
+    """Rend le contrat PEE d'un dossier (dict) ; renvoie (nom de fichier, PDF)."""
+    from weasyprint import HTML
+    html = _env.get_template(TEMPLATE).render(
+        d=dossier, assets=_assets, today=datetime.date.today().strftime("%d/%m/%Y")
+    )
+    pdf = HTML(string=html, base_url=BASE_DIR).write_pdf(stylesheets=[_css], font_config=_fonts)
+    return contract_filename(dossier), pdf
+
+
+def contract_filename(dossier):
+    name = unicodedata.normalize("NFKD", dossier.get("company_name") or "").encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+    return f"contrat-pee-{dossier['id']}" + (f"-{slug}" if slug else "") + ".pdf"
+
+
+def _env_int(name, default):
+    try:
+        value = int(os.environ.get(name, ""))
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+
+def document_workers():
+    # Chaque worker gunicorn a son propre pool : par défaut on partage les CPU entre eux
+    # (WEB_CONCURRENCY est aussi lu par gunicorn pour son nombre de workers).
+    # Si DOCUMENT_WORKERS est fixé, prévoir DOCUMENT_WORKERS x workers <= nombre de CPU.
+    default = max(1, (os.cpu_count() or 1) // _env_int("WEB_CONCURRENCY", 1))
+    return _env_int("DOCUMENT_WORKERS", default)
+
+
+def get_pool():
+    # Créé à la demande dans chaque worker gunicorn ; "spawn" évite de forker un process multi-threadé.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=document_workers(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def reset_pool(pool):
+    # Un pool dont un process est mort reste inutilisable : on le recrée à la requête suivante.
+    # Seul le pool cassé est écarté, jamais celui qu'un autre thread vient de reconstruire.
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_one(dossier):
+    pool = get_pool()
+    try:
+        return pool.submit(render_contract, dossier).result()
+    except BrokenProcessPool:
+        reset_pool(pool)
+        raise
+
+
+class _Sink(io.RawIOBase):
+    """Flux non seekable : zipfile y écrit, on vide les octets au fil de l'eau."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def stream_zip(dossiers):
+    """Génère le ZIP des contrats, chaque PDF étant envoyé dès qu'il est rendu."""
+    sink = _Sink()
+    pool = get_pool()
+    todo, pending, failed = iter(dossiers), collections.deque(), []
+
+    def submit(n):
+        pending.extend((d, pool.submit(render_contract, d)) for d in itertools.islice(todo, n))
+
+    # Fenêtre bornée : un nouveau rendu n'est soumis qu'une fois un PDF envoyé au client,
+    # la mémoire suit donc le débit de téléchargement et non la taille du lot.
+    submit(2 * document_workers())
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+            while pending:
+                dossier, future = pending.popleft()
+                try:
+                    name, pdf = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception:
+                    # Un dossier mal renseigné ne doit pas faire perdre le reste du lot.
+                    log.exception("Échec du rendu du contrat pour le dossier %s", dossier["id"])
+                    failed.append(dossier)
+                else:
+                    zf.writestr(name, pdf)
+                    yield sink.drain()
+                submit(1)
+            if failed:
+                zf.writestr("erreurs.txt", "Contrats non générés :\n" + "".join(
+                    f"- dossier {d['id']} ({d.get('company_name') or ''})\n" for d in failed
+                ))
+    except BrokenProcessPool:
+        reset_pool(pool)
+        raise
+    finally:
+        # Client déconnecté en cours de route : inutile de rendre le reste.
+        for _, f in pending:
+            f.cancel()
+    yield sink.drain()
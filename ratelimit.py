@@ -0,0 +1,132 @@
+import math, os, random, sqlite3, threading, time
+from flask import request, g
+
+# Buckets par endpoint : (capacité, jetons rechargés par seconde).
+# Une clé (méthode, endpoint) ne limite que cette méthode, p. ex. le POST d'un formulaire.
+DEFAULT_LIMITS = {
+    ("POST", "create_dossier"): (5, 5 / 60),
+    "dossiers": (60, 2),
+}
+DEFAULT_LIMIT = (30, 1)
+
+
+class BucketStore:
+    """Token buckets partagés entre les workers gunicorn via un fichier SQLite."""
+
+    def __init__(self, path, timeout=0.25):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            self._local.db = db
+        return db
+
+    def take(self, key, capacity, rate):
+        """Consomme un jeton ; renvoie 0 si accepté, sinon le délai d'attente en secondes."""
+        db = self._conn()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key=?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            db.execute("INSERT OR REPLACE INTO buckets(key, tokens, updated) VALUES (?,?,?)", (key, tokens, now))
+            if random.random() < 0.01:
+                # Un bucket inactif depuis une heure est plein : inutile de le garder.
+                db.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class RateLimiter:
+    """Limitation par IP et plafond de requêtes simultanées par worker."""
+
+    def __init__(self, app=None, store=None):
+        self.store = store
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_DB", os.path.join(app.root_path, "ratelimit.db"))
+        app.config.setdefault("RATELIMITS", DEFAULT_LIMITS)
+        app.config.setdefault("RATELIMIT_DEFAULT", DEFAULT_LIMIT)
+        app.config.setdefault("MAX_INFLIGHT", int(os.environ.get("MAX_INFLIGHT", 4)))
+        # Endpoints longs (exports) : plafond propre {endpoint: (slots, Retry-After)},
+        # hors du plafond général pour ne pas bloquer les autres agents.
+        app.config.setdefault("INFLIGHT_GROUPS", {})
+        if self.store is None:
+            self.store = BucketStore(app.config["RATELIMIT_DB"])
+        self.limits = app.config["RATELIMITS"]
+        self.default = app.config["RATELIMIT_DEFAULT"]
+        self.inflight = threading.BoundedSemaphore(app.config["MAX_INFLIGHT"])
+        self.groups = {
+            endpoint: (threading.BoundedSemaphore(slots), retry_after)
+            for endpoint, (slots, retry_after) in app.config["INFLIGHT_GROUPS"].items()
+        }
+        # Doit passer avant les autres before_request (init_db, etc.).
+        app.before_request_funcs.setdefault(None, []).insert(0, self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def client_key(self):
+        # Pas d'authentification dans cette app : la session est un cookie signé côté client,
+        # on ne peut donc pas s'y fier pour identifier quelqu'un. Clé par IP uniquement.
+        return f"ip:{request.remote_addr}"
+
+    def before_request(self):
+        if request.endpoint in (None, "static"):
+            return None
+        # Le slot passe avant le jeton : une requête délestée ne consomme pas de quota.
+        slot, retry_after = self.groups.get(request.endpoint, (self.inflight, 1))
+        if not slot.acquire(blocking=False):
+            return self.reject(503, "Serveur surchargé, réessayez dans un instant.", retry_after)
+        g._inflight = slot
+        capacity, rate = self.limits.get(
+            (request.method, request.endpoint), self.limits.get(request.endpoint, self.default)
+        )
+        try:
+            wait = self.store.take(f"{request.method}:{request.endpoint}:{self.client_key()}", capacity, rate)
+        except sqlite3.OperationalError:
+            # Store verrouillé : on laisse passer, le plafond de concurrence protège le worker.
+            wait = 0
+        if wait:
+            return self.reject(429, "Trop de requêtes, réessayez plus tard.", wait)
+        return None
+
+    def after_request(self, response):
+        # Une réponse streamée (ZIP de contrats) occupe le thread jusqu'à sa fermeture :
+        # le slot n'est rendu qu'à ce moment-là.
+        slot = g.pop("_inflight", None)
+        if slot is not None:
+            response.call_on_close(slot.release)
+        return response
+
+    def teardown_request(self, exception):
+        # Cas d'erreur sans réponse : after_request n'a pas rendu le slot.
+        slot = g.pop("_inflight", None)
+        if slot is not None:
+            slot.release()
+
+    def reject(self, status, message, retry_after):
+        return message, status, {
+            "Retry-After": str(max(1, math.ceil(retry_after))),
+            "Content-Type": "text/plain; charset=utf-8",
+        }